@@ -26,16 +26,50 @@ from charms.osm_libs.v0.utils import (
     check_service_active,
 )
 from charms.prometheus_k8s.v0.prometheus_scrape import MetricsEndpointProvider
+from ops import pebble
 from ops.charm import CharmBase, RelationBrokenEvent
 from ops.main import main
 from ops.model import ActiveStatus, BlockedStatus, WaitingStatus
+from tenacity import retry, retry_if_exception_type, stop_after_attempt, wait_exponential
 
 # Log messages can be retrieved using juju debug-log
 logger = logging.getLogger(__name__)
 
 PORT = 9216
 
-VALID_LOG_LEVELS = ["info", "debug", "warning", "error", "critical"]
+# Scrape jobs handed to MetricsEndpointProvider, which copies them when sanitizing.
+METRICS_JOBS = [{"static_configs": [{"targets": [f"*:{PORT}"]}]}]
+
+VALID_LOG_LEVELS = frozenset({"TRACE", "DEBUG", "INFO", "WARN", "ERROR", "FATAL"})
+
+# Retry short Pebble hiccups in-process instead of deferring the event straight away.
+_pebble_retry = retry(
+    stop=stop_after_attempt(3),
+    wait=wait_exponential(multiplier=0.05, max=0.5),
+    retry=retry_if_exception_type(pebble.ConnectionError),
+    reraise=True,
+)
+
+# Static parts of the Pebble layer; only the mongodb uri changes between builds.
+# Shared between layers, so they must not be mutated.
+PEBBLE_LAYER_TEMPLATE = {
+    "summary": "mongodb-exporter layer",
+    "description": "pebble config layer for mongodb-exporter",
+    "checks": {
+        "online": {
+            "override": "replace",
+            "level": "ready",
+            "tcp": {
+                "port": PORT,
+            },
+        },
+    },
+}
+PEBBLE_SERVICE_TEMPLATE = {
+    "override": "replace",
+    "summary": "mongodb-exporter service",
+    "startup": "enabled",
+}
 
 
 class MongodbExporterCharm(CharmBase):
@@ -44,6 +78,9 @@ class MongodbExporterCharm(CharmBase):
     def __init__(self, *args):
         super().__init__(*args)
         self.mongodb_uri = None
+        self._last_layer = None
+        self._last_ingress_config = None
+        self._validated_config = None
         self.pebble_service_name = "mongodb-exporter"
         self.container = self.unit.get_container("mongodb-exporter")
         self.ingress = IngressRequires(
@@ -54,11 +91,10 @@ class MongodbExporterCharm(CharmBase):
                 "service-port": PORT,
             },
         )
-        jobs = [{"static_configs": [{"targets": [f"*:{PORT}"]}]}]
         self.metrics_consumer = MetricsEndpointProvider(
             self,
             relation_name="metrics-endpoint",
-            jobs=jobs,
+            jobs=METRICS_JOBS,
             refresh_event=self.on.config_changed,
         )
         self._grafana_dashboards = GrafanaDashboardProvider(
@@ -71,14 +107,18 @@ class MongodbExporterCharm(CharmBase):
             extra_user_roles="admin",
         )
 
-        self.framework.observe(
-            self.on.mongodb_exporter_pebble_ready,
-            self._on_mongodb_exporter_pebble_ready,
-        )
-        self.framework.observe(self.on.config_changed, self._on_config_changed)
-        self.framework.observe(self.on.update_status, self._on_update_status)
-        self.framework.observe(self.mongodb_client.on.database_created, self._on_database_created)
-        self.framework.observe(self.on["mongodb"].relation_broken, self._on_db_relation_broken)
+        self._observe_charm_events()
+
+    def _observe_charm_events(self) -> None:
+        event_handler_mapping = {
+            self.on.mongodb_exporter_pebble_ready: self._on_mongodb_exporter_pebble_ready,
+            self.on.config_changed: self._on_config_changed,
+            self.on.update_status: self._on_update_status,
+            self.mongodb_client.on.database_created: self._on_database_created,
+            self.on["mongodb"].relation_broken: self._on_db_relation_broken,
+        }
+        for event, handler in event_handler_mapping.items():
+            self.framework.observe(event, handler)
 
     def _on_mongodb_exporter_pebble_ready(self, event):
         """Define and start a workload using the Pebble API.
@@ -90,14 +130,16 @@ class MongodbExporterCharm(CharmBase):
         """
         try:
             self.mongodb_uri = self._get_mongodb_uri(event)
+            layer = self._build_pebble_layer()
             # Add initial Pebble config layer using the Pebble API
             self.container.add_layer(
                 "mongodb-exporter",
-                self._pebble_layer,
+                layer,
                 combine=True,
             )
             # Make Pebble reevaluate its plan, ensuring any services are started if enabled.
             self.container.replan()
+            self._last_layer = layer
             # Learn more about statuses in the SDK docs:
             # https://juju.is/docs/sdk/constructs#heading--statuses
             self.unit.status = ActiveStatus()
@@ -106,30 +148,35 @@ class MongodbExporterCharm(CharmBase):
             self.unit.status = error.status
 
     def _configure_service(self, event) -> None:
-        if self.container.can_connect():
-            # Push an updated layer with the new config
-            self.container.add_layer("mongodb-exporter", self._pebble_layer, combine=True)
-            self.container.replan()
+        layer = self._build_pebble_layer()
+        if layer == self._last_layer:
+            # The layer is already in the plan, skip the Pebble round trip
             self.unit.status = ActiveStatus()
-        else:
+            return
+        try:
+            self._push_layer(layer)
+        except pebble.ConnectionError:
             # We were unable to connect to the Pebble API, so we defer this event
             event.defer()
             self.unit.status = WaitingStatus("waiting for Pebble API")
+            return
+        self._last_layer = layer
+        self.unit.status = ActiveStatus()
+
+    @_pebble_retry
+    def _push_layer(self, layer: dict) -> None:
+        """Push the layer to Pebble and replan, retrying transient connection errors."""
+        self.container.add_layer("mongodb-exporter", layer, combine=True)
+        self.container.replan()
 
     def _get_mongodb_relation(self, event):
-        if type(event).__name__ == "RelationBrokenEvent":
+        if isinstance(event, RelationBrokenEvent):
             return None
         if self.mongodb_client.is_resource_created():
-            return list(self.mongodb_client.fetch_relation_data().values())[0]["uris"]
+            data = self.mongodb_client.fetch_relation_data()
+            return next(iter(data.values()))["uris"]
         return None
 
-    def _get_mongodb_config(self):
-        try:
-            self._validate_config()
-            return self.model.config.get("mongodb-uri")
-        except CharmError as error:
-            raise CharmError(error.message) from error
-
     def _get_mongodb_uri(self, event=None) -> str:
         """Return Mongodb uri.
 
@@ -137,8 +184,9 @@ class MongodbExporterCharm(CharmBase):
             CharmError: if no Mongodb uri.
         """
         relation = self._get_mongodb_relation(event)
+        self._validate_config()
 
-        if configuration := self._get_mongodb_config():
+        if configuration := self.model.config.get("mongodb-uri"):
             if relation:
                 raise CharmError(
                     "Mongodb cannot added via relation and via config at the same time"
@@ -156,26 +204,21 @@ class MongodbExporterCharm(CharmBase):
         Raises:
             CharmError: if charm configuration is invalid.
         """
+        cfg = self.model.config
+        log_level = cfg["log-level"].upper()
+        uri = cfg.get("mongodb-uri")
+        if (log_level, uri) == self._validated_config:
+            # These values already passed validation in this charm instance
+            return
         logger.debug("Validating config")
-        if self.config["log-level"].upper() not in [
-            "TRACE",
-            "DEBUG",
-            "INFO",
-            "WARN",
-            "ERROR",
-            "FATAL",
-        ]:
-            self.unit.status = BlockedStatus(
-                f"invalid log level: {self.model.config['log-level'].upper()}"
-            )
+        if log_level not in VALID_LOG_LEVELS:
+            self.unit.status = BlockedStatus(f"invalid log level: {log_level}")
             raise CharmError("invalid value for log-level option")
 
-        if self.model.config.get("mongodb-uri"):
-            if not self.model.config.get("mongodb-uri").startswith("mongodb://"):
-                self.unit.status = BlockedStatus(
-                    f"invalid mongodb uri: {self.model.config['mongodb-uri']}"
-                )
-                raise CharmError("mongodb-uri is not properly formed")
+        if uri and not uri.startswith("mongodb://"):
+            self.unit.status = BlockedStatus(f"invalid mongodb uri: {uri}")
+            raise CharmError("mongodb-uri is not properly formed")
+        self._validated_config = (log_level, uri)
 
     def _on_config_changed(self, event) -> None:
         """Handle changed configuration."""
@@ -212,8 +255,10 @@ class MongodbExporterCharm(CharmBase):
         """Event triggered when a database was created for this application via relation."""
         try:
             self.mongodb_uri = self._get_mongodb_uri(event)
-            self._on_config_changed(event)
+            self._configure_service(event)
+            self._update_ingress_config()
         except CharmError as error:
+            logger.warning(error.message)
             self.unit.status = error.status
 
     def _update_ingress_config(self) -> None:
@@ -221,35 +266,25 @@ class MongodbExporterCharm(CharmBase):
         ingress_config = {
             "service-hostname": self.model.config.get("external-hostname"),
         }
-        logger.debug(f"updating ingress-config: {ingress_config}")
+        if ingress_config == self._last_ingress_config:
+            return
+        logger.debug("updating ingress-config: %s", ingress_config)
         self.ingress.update_config(ingress_config)
+        # The library only writes the relation on the leader unit
+        if self.unit.is_leader():
+            self._last_ingress_config = ingress_config
 
-    @property
-    def _pebble_layer(self):
+    def _build_pebble_layer(self) -> dict:
         """Return a dictionary representing a Pebble layer."""
-        environments = {"MONGODB_URI": self.mongodb_uri}
-
         return {
-            "summary": "mongodb-exporter layer",
-            "description": "pebble config layer for mongodb-exporter",
+            **PEBBLE_LAYER_TEMPLATE,
             "services": {
                 self.pebble_service_name: {
-                    "override": "replace",
-                    "summary": "mongodb-exporter service",
+                    **PEBBLE_SERVICE_TEMPLATE,
                     "command": f"/bin/mongodb_exporter --mongodb.uri={self.mongodb_uri}",
-                    "startup": "enabled",
-                    "environment": environments,
+                    "environment": {"MONGODB_URI": self.mongodb_uri},
                 }
             },
-            "checks": {
-                "online": {
-                    "override": "replace",
-                    "level": "ready",
-                    "tcp": {
-                        "port": PORT,
-                    },
-                },
-            },
         }
 
 
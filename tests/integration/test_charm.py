@@ -10,9 +10,14 @@ import pytest
 import yaml
 from pytest_operator.plugin import OpsTest
 
+try:
+    from yaml import CSafeLoader as SafeLoader
+except ImportError:
+    from yaml import SafeLoader
+
 logger = logging.getLogger(__name__)
 
-METADATA = yaml.safe_load(Path("./metadata.yaml").read_text())
+METADATA = yaml.load(Path("./metadata.yaml").read_bytes(), Loader=SafeLoader)
 APP_NAME = METADATA["name"]
 APP_CONFIG = {"external-hostname": "mongodb-exporter.127.0.0.1.nip.io"}
 MONGO_DB_CHARM = "mongodb-k8s"
@@ -28,21 +33,34 @@ async def test_build_and_deploy(ops_test: OpsTest):
 
     Assert on the unit status before any relations/configurations take place.
     """
-    # Build and deploy charm from local source folder
-    charm = await ops_test.build_charm(".")
     resources = {"image": METADATA["resources"]["image"]["upstream-source"]}
-
-    await asyncio.gather(
-        ops_test.model.deploy(
-            charm, resources=resources, application_name=APP_NAME, series="jammy"
-        ),
-        ops_test.model.deploy(INGRESS_CHARM, application_name=INGRESS_APP, channel="stable"),
+    # Start deploying the related charms while the charm-under-test is being built
+    ingress_deploy = asyncio.create_task(
+        ops_test.model.deploy(INGRESS_CHARM, application_name=INGRESS_APP, channel="stable")
+    )
+    mongodb_deploy = asyncio.create_task(
         ops_test.model.deploy(
             MONGO_DB_CHARM,
             application_name=MONGO_DB_APP,
             channel="edge",
             series="jammy",
+        )
+    )
+
+    # Build and deploy charm from local source folder
+    try:
+        charm = await ops_test.build_charm(".")
+    except BaseException:
+        ingress_deploy.cancel()
+        mongodb_deploy.cancel()
+        await asyncio.gather(ingress_deploy, mongodb_deploy, return_exceptions=True)
+        raise
+    await asyncio.gather(
+        ops_test.model.deploy(
+            charm, resources=resources, application_name=APP_NAME, series="jammy"
         ),
+        ingress_deploy,
+        mongodb_deploy,
     )
 
     async with ops_test.fast_forward():
@@ -0,0 +1,61 @@
+# Copyright 2023 Guillermo
+# See LICENSE file for licensing details.
+#
+# Learn more about testing at: https://juju.is/docs/sdk/testing
+
+import ops.testing
+import pytest
+from charm import MongodbExporterCharm
+from ops.testing import Harness
+
+
+@pytest.fixture(scope="session", autouse=True)
+def _simulate_can_connect():
+    # Enable more accurate simulation of container networking.
+    # For more information, see https://juju.is/docs/sdk/testing#heading--simulate-can-connect
+    previous = getattr(ops.testing, "SIMULATE_CAN_CONNECT", False)
+    ops.testing.SIMULATE_CAN_CONNECT = True
+    yield
+    ops.testing.SIMULATE_CAN_CONNECT = previous
+
+
+@pytest.fixture(autouse=True)
+def _no_pebble_retry_wait(monkeypatch):
+    # Retry Pebble calls immediately instead of sleeping between attempts
+    monkeypatch.setattr(MongodbExporterCharm._push_layer.retry, "sleep", lambda _: None)
+
+
+@pytest.fixture
+def harness_cannot_connect():
+    harness = Harness(MongodbExporterCharm)
+    harness.begin()
+    yield harness
+    harness.cleanup()
+
+
+@pytest.fixture
+def harness(harness_cannot_connect):
+    harness_cannot_connect.set_can_connect("mongodb-exporter", True)
+    return harness_cannot_connect
+
+
+@pytest.fixture
+def mongodb_relation(harness):
+    relation_id = harness.add_relation("mongodb", "mongodb")
+    harness.add_relation_unit(relation_id, "mongodb/0")
+    harness.update_relation_data(
+        relation_id,
+        "mongodb",
+        {
+            "uris": "mongodb://relation-3:27017",
+            "username": "mongo",
+            "password": "mongo",
+        },
+    )
+    return relation_id
+
+
+@pytest.fixture
+def harness_with_uri(harness):
+    harness.update_config({"mongodb-uri": "mongodb://mongodb:27017/"})
+    return harness
@@ -3,216 +3,246 @@
 #
 # Learn more about testing at: https://juju.is/docs/sdk/testing
 
-import unittest
-
-import ops.testing
-from charm import MongodbExporterCharm
-from charms.data_platform_libs.v0.data_interfaces import DatabaseCreatedEvent
-from ops.model import ActiveStatus, BlockedStatus, WaitingStatus
-from ops.testing import Harness
-
-
-class TestCharm(unittest.TestCase):
-    """Class to test the charm."""
-
-    def setUp(self):
-        # Enable more accurate simulation of container networking.
-        # For more information, see https://juju.is/docs/sdk/testing#heading--simulate-can-connect
-        ops.testing.SIMULATE_CAN_CONNECT = True
-        self.addCleanup(setattr, ops.testing, "SIMULATE_CAN_CONNECT", False)
-
-        self.harness = Harness(MongodbExporterCharm)
-        self.addCleanup(self.harness.cleanup)
-        self.harness.begin()
-
-    def test_mongodb_exporter_pebble_ready(self):
-        """Test to check the plan created is the expected one."""
-        # Expected plan after Pebble ready with default config
-        expected_plan = {
-            "services": {
-                "mongodb-exporter": {
-                    "override": "replace",
-                    "summary": "mongodb-exporter service",
-                    "command": "/bin/mongodb_exporter --mongodb.uri=mongodb://mongodb:27017/",
-                    "startup": "enabled",
-                    "environment": {"MONGODB_URI": "mongodb://mongodb:27017/"},
-                },
-            },
-        }
-        self.harness.update_config({"mongodb-uri": "mongodb://mongodb:27017/"})
-        self.harness.container_pebble_ready("mongodb-exporter")
-        updated_plan = self.harness.get_container_pebble_plan("mongodb-exporter").to_dict()
-        self.assertEqual(expected_plan, updated_plan)
-        service = self.harness.model.unit.get_container("mongodb-exporter").get_service(
-            "mongodb-exporter"
-        )
-        self.assertTrue(service.is_running())
-        self.assertEqual(self.harness.model.unit.status, ActiveStatus())
-
-    def test_mongodb_exporter_pebble_not_ready(self):
-        """Test to check the plan created is the expected one."""
-        # Expected plan after Pebble ready with default config
-        expected_plan = {}
-        error_message = (
-            "No Mongodb uri added. Mongodb uri needs to be added via relation or via config"
-        )
-        self.harness.container_pebble_ready("mongodb-exporter")
-        updated_plan = self.harness.get_container_pebble_plan("mongodb-exporter").to_dict()
-        self.assertEqual(expected_plan, updated_plan)
-        self.assertEqual(self.harness.model.unit.status, BlockedStatus(error_message))
-
-    def test_config_changed_valid_can_connect(self):
-        """Valid config change for mongodb-uri parameter."""
-        self.harness.set_can_connect("mongodb-exporter", True)
-        self.harness.update_config({"mongodb-uri": "mongodb://mongodb:27017/"})
-        updated_plan = self.harness.get_container_pebble_plan("mongodb-exporter").to_dict()
-        updated_env = updated_plan["services"]["mongodb-exporter"]["environment"]
-        self.assertEqual(updated_env, {"MONGODB_URI": "mongodb://mongodb:27017/"})
-        self.assertEqual(self.harness.model.unit.status, ActiveStatus())
-
-    def test_config_changed_valid_cannot_connect(self):
-        """Test cannot connect to Pebble."""
-        self.harness.update_config({"mongodb-uri": "mongodb://mongodb:27017/"})
-        self.assertIsInstance(self.harness.model.unit.status, WaitingStatus)
-
-    def test_config_mongodb_uri_changed_invalid(self):
-        """Invalid config change for mongodb-uri parameter."""
-        self.harness.set_can_connect("mongodb-exporter", True)
-        self.harness.update_config({"mongodb-uri": "foobar"})
-        self.assertIsInstance(self.harness.model.unit.status, BlockedStatus)
-
-    def test_config_log_changed_invalid(self):
-        """Invalid config change for log-level parameter."""
-        self.harness.set_can_connect("mongodb-exporter", True)
-        # Trigger a config-changed event with an updated value
-        self.harness.update_config({"log-level": "foobar"})
-        # Check the charm is in BlockedStatus
-        self.assertIsInstance(self.harness.model.unit.status, BlockedStatus)
-
-    def test_config_log_changed_no_mongodb(self):
-        """Valid config change for log-level parameter."""
-        error_message = (
-            "No Mongodb uri added. Mongodb uri needs to be added via relation or via config"
-        )
-        self.harness.set_can_connect("mongodb-exporter", True)
-        self.harness.update_config({"log-level": "INFO"})
-        self.assertEqual(self.harness.model.unit.status, BlockedStatus(error_message))
-
-    def test_no_config(self):
-        """No database related or configured in the charm."""
-        self.harness.set_can_connect("mongodb-exporter", True)
-        self.harness.charm.on.config_changed.emit()
-        self.assertIsInstance(self.harness.model.unit.status, BlockedStatus)
-
-    def test_mongodb_relation(self):
-        """Database related in the charm."""
-        self.harness.set_can_connect("mongodb-exporter", True)
-        relation_id = self.harness.add_relation("mongodb", "mongodb")
-        self.harness.add_relation_unit(relation_id, "mongodb/0")
-        self.harness.update_relation_data(
-            relation_id,
-            "mongodb",
-            {
-                "uris": "mongodb://relation-3:27017",
-                "username": "mongo",
-                "password": "mongo",
-            },
-        )
-        self.harness.charm.on.config_changed.emit()
-        self.assertIsInstance(self.harness.model.unit.status, ActiveStatus)
-
-    def test_mongodb_relation_broken(self):
-        """Remove relation of the database, no database in config."""
-        self.harness.set_can_connect("mongodb-exporter", True)
-        relation_id = self.harness.add_relation("mongodb", "mongodb")
-        self.harness.add_relation_unit(relation_id, "mongodb/0")
-        self.harness.update_relation_data(
-            relation_id,
-            "mongodb",
-            {
-                "uris": "mongodb://relation-3:27017",
-                "username": "mongo",
-                "password": "mongo",
-            },
-        )
-        self.harness.charm.on.config_changed.emit()
-        self.assertIsInstance(self.harness.model.unit.status, ActiveStatus)
-        self.harness.remove_relation(relation_id)
-        self.assertIsInstance(self.harness.model.unit.status, BlockedStatus)
-
-    def test_update_status_no_mongo(self):
-        """update_status test Blocked because no Mongo DB."""
-        self.harness.set_can_connect("mongodb-exporter", True)
-        self.harness.charm.on.update_status.emit()
-        self.assertIsInstance(self.harness.model.unit.status, BlockedStatus)
-
-    def test_update_status_success(self):
-        """update_status test successful."""
-        self.harness.set_can_connect("mongodb-exporter", True)
-        self.harness.update_config({"mongodb-uri": "mongodb://mongodb:27017/"})
-        self.harness.charm.on.update_status.emit()
-        self.assertIsInstance(self.harness.model.unit.status, ActiveStatus)
-
-    def test_db_creation(self):
-        """DB creation test successful."""
-        self.harness.set_can_connect("mongodb-exporter", True)
-        relation_id = self.harness.add_relation("mongodb", "mongodb")
-        self.harness.add_relation_unit(relation_id, "mongodb/0")
-        self.harness.update_relation_data(
-            relation_id,
-            "mongodb",
-            {
-                "uris": "mongodb://relation-3:27017",
-                "username": "mongo",
-                "password": "mongo",
-            },
-        )
-        self.harness.charm._on_database_created(DatabaseCreatedEvent)
-        self.assertIsInstance(self.harness.model.unit.status, ActiveStatus)
-
-    def test_db_creation_failed(self):
-        """DB creation failedtest."""
-        error_message = (
-            "No Mongodb uri added. Mongodb uri needs to be added via relation or via config"
-        )
-        self.harness.set_can_connect("mongodb-exporter", True)
-        self.harness.charm._on_database_created(DatabaseCreatedEvent)
-        self.assertEqual(self.harness.model.unit.status, BlockedStatus(error_message))
-
-    def test_db_duplicated(self):
-        """Connected to Mongo through config and relation."""
-        error_message = "Mongodb cannot added via relation and via config at the same time"
-        self.harness.set_can_connect("mongodb-exporter", True)
-        relation_id = self.harness.add_relation("mongodb", "mongodb")
-        self.harness.add_relation_unit(relation_id, "mongodb/0")
-        self.harness.update_relation_data(
-            relation_id,
-            "mongodb",
-            {
-                "uris": "mongodb://relation-3:27017",
-                "username": "mongo",
-                "password": "mongo",
-            },
-        )
-        self.harness.update_config({"mongodb-uri": "mongodb://mongodb:27017/"})
-        self.assertEqual(self.harness.model.unit.status, BlockedStatus(error_message))
-
-    def test_db_duplicated_and_relation_broken(self):
-        """Connected to Mongo through config and relation and then remove the relation."""
-        error_message = "Mongodb cannot added via relation and via config at the same time"
-        self.harness.set_can_connect("mongodb-exporter", True)
-        relation_id = self.harness.add_relation("mongodb", "mongodb")
-        self.harness.add_relation_unit(relation_id, "mongodb/0")
-        self.harness.update_relation_data(
-            relation_id,
-            "mongodb",
-            {
-                "uris": "mongodb://relation-3:27017",
-                "username": "mongo",
-                "password": "mongo",
-            },
-        )
-        self.harness.update_config({"mongodb-uri": "mongodb://mongodb:27017/"})
-        self.assertEqual(self.harness.model.unit.status, BlockedStatus(error_message))
-        self.harness.remove_relation(relation_id)
-        self.assertIsInstance(self.harness.model.unit.status, ActiveStatus)
+from unittest.mock import patch
+
+import pytest
+from ops import pebble
+from ops.framework import EventBase
+from ops.model import ActiveStatus, BlockedStatus, MaintenanceStatus, WaitingStatus
+
+# Expected plan after Pebble ready with mongodb-uri configured
+EXPECTED_PLAN = {
+    "services": {
+        "mongodb-exporter": {
+            "override": "replace",
+            "summary": "mongodb-exporter service",
+            "command": "/bin/mongodb_exporter --mongodb.uri=mongodb://mongodb:27017/",
+            "startup": "enabled",
+            "environment": {"MONGODB_URI": "mongodb://mongodb:27017/"},
+        },
+    },
+}
+
+
+def test_mongodb_exporter_pebble_ready(harness_cannot_connect):
+    """Test to check the plan created is the expected one."""
+    harness = harness_cannot_connect
+    # Pebble is unreachable, so config-changed is deferred without pushing a layer
+    harness.update_config({"mongodb-uri": "mongodb://mongodb:27017/"})
+    assert isinstance(harness.model.unit.status, WaitingStatus)
+    harness.set_can_connect("mongodb-exporter", True)
+    assert harness.get_container_pebble_plan("mongodb-exporter").to_dict() == {}
+    harness.container_pebble_ready("mongodb-exporter")
+    updated_plan = harness.get_container_pebble_plan("mongodb-exporter").to_dict()
+    assert EXPECTED_PLAN == updated_plan
+    service = harness.model.unit.get_container("mongodb-exporter").get_service("mongodb-exporter")
+    assert service.is_running()
+    assert harness.model.unit.status == ActiveStatus()
+
+
+def test_mongodb_exporter_pebble_not_ready(harness):
+    """Test to check the plan created is the expected one."""
+    # Expected plan after Pebble ready with default config
+    expected_plan = {}
+    error_message = (
+        "No Mongodb uri added. Mongodb uri needs to be added via relation or via config"
+    )
+    harness.container_pebble_ready("mongodb-exporter")
+    updated_plan = harness.get_container_pebble_plan("mongodb-exporter").to_dict()
+    assert expected_plan == updated_plan
+    assert harness.model.unit.status == BlockedStatus(error_message)
+
+
+def test_config_changed_valid_can_connect(harness_with_uri):
+    """Valid config change for mongodb-uri parameter."""
+    updated_plan = harness_with_uri.get_container_pebble_plan("mongodb-exporter").to_dict()
+    updated_env = updated_plan["services"]["mongodb-exporter"]["environment"]
+    assert updated_env == {"MONGODB_URI": "mongodb://mongodb:27017/"}
+    assert harness_with_uri.model.unit.status == ActiveStatus()
+
+
+def test_config_changed_valid_cannot_connect(harness_cannot_connect):
+    """Test cannot connect to Pebble."""
+    harness_cannot_connect.update_config({"mongodb-uri": "mongodb://mongodb:27017/"})
+    assert isinstance(harness_cannot_connect.model.unit.status, WaitingStatus)
+
+
+def test_config_changed_unchanged_layer_not_pushed(harness):
+    """The layer is only pushed to Pebble when it changes."""
+    container = harness.charm.container
+    with patch.object(
+        container, "add_layer", wraps=container.add_layer
+    ) as add_layer, patch.object(container, "replan", wraps=container.replan) as replan:
+        harness.update_config({"mongodb-uri": "mongodb://mongodb:27017/"})
+        harness.charm.on.config_changed.emit()
+        assert add_layer.call_count == 1
+        assert replan.call_count == 1
+
+        harness.update_config({"mongodb-uri": "mongodb://other:27017/"})
+        assert add_layer.call_count == 2
+        assert replan.call_count == 2
+    updated_plan = harness.get_container_pebble_plan("mongodb-exporter").to_dict()
+    updated_env = updated_plan["services"]["mongodb-exporter"]["environment"]
+    assert updated_env == {"MONGODB_URI": "mongodb://other:27017/"}
+    assert harness.model.unit.status == ActiveStatus()
+
+
+def test_config_changed_pebble_transient_error(harness):
+    """A Pebble connection error that clears on retry does not defer the event."""
+    container = harness.charm.container
+    with patch.object(
+        container,
+        "add_layer",
+        side_effect=[pebble.ConnectionError("socket not ready"), None],
+    ) as add_layer, patch.object(container, "replan"), patch.object(EventBase, "defer") as defer:
+        harness.update_config({"mongodb-uri": "mongodb://mongodb:27017/"})
+    assert add_layer.call_count == 2
+    defer.assert_not_called()
+    assert harness.model.unit.status == ActiveStatus()
+
+
+def test_config_changed_pebble_retries_exhausted(harness):
+    """The event is deferred once every Pebble attempt fails."""
+    container = harness.charm.container
+    with patch.object(
+        container, "add_layer", side_effect=pebble.ConnectionError("socket not ready")
+    ) as add_layer, patch.object(EventBase, "defer") as defer:
+        harness.update_config({"mongodb-uri": "mongodb://mongodb:27017/"})
+    assert add_layer.call_count == 3
+    defer.assert_called_once()
+    assert harness.model.unit.status == WaitingStatus("waiting for Pebble API")
+
+
+@pytest.mark.parametrize(
+    "trigger,expected_message",
+    [
+        pytest.param(
+            lambda h: h.update_config({"mongodb-uri": "foobar"}),
+            "mongodb-uri is not properly formed",
+            id="bad-mongodb-uri",
+        ),
+        pytest.param(
+            lambda h: h.update_config({"log-level": "foobar"}),
+            "invalid value for log-level option",
+            id="bad-log-level",
+        ),
+        pytest.param(
+            lambda h: h.update_config({"log-level": "INFO"}),
+            "No Mongodb uri added",
+            id="no-mongodb",
+        ),
+        pytest.param(
+            lambda h: h.charm.on.config_changed.emit(),
+            "No Mongodb uri added",
+            id="no-config",
+        ),
+        pytest.param(
+            lambda h: h.charm.on.update_status.emit(),
+            "No Mongodb uri added",
+            id="update-status-no-mongodb",
+        ),
+    ],
+)
+def test_blocked(harness, trigger, expected_message):
+    """Events that leave the charm blocked when no valid Mongodb is available."""
+    trigger(harness)
+    status = harness.model.unit.status
+    assert isinstance(status, BlockedStatus)
+    assert expected_message in status.message
+
+
+def test_config_revalidated_after_change(harness_with_uri):
+    """Previously accepted config does not hide later invalid values."""
+    blocked = BlockedStatus("mongodb-uri is not properly formed")
+    harness_with_uri.update_config({"mongodb-uri": "foobar"})
+    assert harness_with_uri.model.unit.status == blocked
+    # The rejected value is checked again, not remembered
+    harness_with_uri.charm.on.config_changed.emit()
+    assert harness_with_uri.model.unit.status == blocked
+    harness_with_uri.update_config({"mongodb-uri": "mongodb://mongodb:27017/"})
+    assert harness_with_uri.model.unit.status == ActiveStatus()
+
+
+def test_ingress_config_not_resent(harness_with_uri):
+    """The ingress relation is only updated when the hostname changes."""
+    harness_with_uri.set_leader(True)
+    ingress = harness_with_uri.charm.ingress
+    with patch.object(ingress, "update_config", wraps=ingress.update_config) as update_config:
+        harness_with_uri.update_config({"external-hostname": "mongodb-exporter.local"})
+        harness_with_uri.charm.on.config_changed.emit()
+        assert update_config.call_count == 1
+        harness_with_uri.update_config({"external-hostname": "mongodb-exporter.other"})
+        assert update_config.call_count == 2
+
+
+def test_ingress_config_sent_after_becoming_leader(harness_with_uri):
+    """A hostname seen while not leader is still written once the unit is leader."""
+    relation_id = harness_with_uri.add_relation("ingress", "ingress")
+    harness_with_uri.add_relation_unit(relation_id, "ingress/0")
+    harness_with_uri.update_config({"external-hostname": "mongodb-exporter.local"})
+    app_data = harness_with_uri.get_relation_data(relation_id, harness_with_uri.charm.app.name)
+    assert "service-hostname" not in app_data
+    harness_with_uri.set_leader(True)
+    harness_with_uri.charm.on.config_changed.emit()
+    app_data = harness_with_uri.get_relation_data(relation_id, harness_with_uri.charm.app.name)
+    assert app_data["service-hostname"] == "mongodb-exporter.local"
+
+
+def test_mongodb_relation(harness, mongodb_relation):
+    """Database related in the charm."""
+    harness.charm.on.config_changed.emit()
+    assert isinstance(harness.model.unit.status, ActiveStatus)
+
+
+def test_mongodb_relation_broken(harness, mongodb_relation):
+    """Remove relation of the database, no database in config."""
+    harness.charm.on.config_changed.emit()
+    assert isinstance(harness.model.unit.status, ActiveStatus)
+    harness.remove_relation(mongodb_relation)
+    assert isinstance(harness.model.unit.status, BlockedStatus)
+
+
+def test_update_status_success(harness_with_uri):
+    """update_status test successful."""
+    harness_with_uri.charm.on.update_status.emit()
+    assert isinstance(harness_with_uri.model.unit.status, ActiveStatus)
+
+
+def test_db_creation(harness, mongodb_relation):
+    """DB creation test successful."""
+    # The fixture already triggered database-created, reset the status to see this one
+    harness.model.unit.status = MaintenanceStatus()
+    relation = harness.model.get_relation("mongodb", mongodb_relation)
+    harness.charm.mongodb_client.on.database_created.emit(relation)
+    assert isinstance(harness.model.unit.status, ActiveStatus)
+    updated_plan = harness.get_container_pebble_plan("mongodb-exporter").to_dict()
+    updated_env = updated_plan["services"]["mongodb-exporter"]["environment"]
+    assert updated_env == {"MONGODB_URI": "mongodb://relation-3:27017"}
+
+
+def test_db_creation_failed(harness):
+    """DB creation failedtest."""
+    error_message = (
+        "No Mongodb uri added. Mongodb uri needs to be added via relation or via config"
+    )
+    # Relation without the provider's credentials
+    relation_id = harness.add_relation("mongodb", "mongodb")
+    relation = harness.model.get_relation("mongodb", relation_id)
+    harness.charm.mongodb_client.on.database_created.emit(relation)
+    assert harness.model.unit.status == BlockedStatus(error_message)
+
+
+def test_db_duplicated(harness, mongodb_relation):
+    """Connected to Mongo through config and relation."""
+    error_message = "Mongodb cannot added via relation and via config at the same time"
+    harness.update_config({"mongodb-uri": "mongodb://mongodb:27017/"})
+    assert harness.model.unit.status == BlockedStatus(error_message)
+
+
+def test_db_duplicated_and_relation_broken(harness, mongodb_relation):
+    """Connected to Mongo through config and relation and then remove the relation."""
+    error_message = "Mongodb cannot added via relation and via config at the same time"
+    harness.update_config({"mongodb-uri": "mongodb://mongodb:27017/"})
+    assert harness.model.unit.status == BlockedStatus(error_message)
+    harness.remove_relation(mongodb_relation)
+    assert isinstance(harness.model.unit.status, ActiveStatus)